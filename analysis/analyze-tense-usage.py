@@ -2,36 +2,49 @@
 # -*- coding: utf-8 -*-
 """Analyze ParlaMint-RO corpus."""
 from argparse import ArgumentParser
+import ahocorasick
 import logging
+import os
 import pandas
+import pickle
+import pyarrow.csv
 import re
+from concurrent.futures import ProcessPoolExecutor
 from lxml import etree
-from datetime import datetime
+from datetime import date as date_type
 from pathlib import Path
 from gensim.utils import tokenize as split_words
-from itertools import product
-from joblib import Parallel, delayed
 
 PRONOUNS = ['eu', 'tu', 'el/ea', 'noi', 'voi', 'ei/ele']
 
+PRONOUN_PATTERN = re.compile(r"^\s*(eu|tu|el\/ea|noi|voi|ei\/ele)\s",
+                             re.IGNORECASE | re.MULTILINE)
 
-def get_future_forms(df):
-    """Get the list of verb forms in the future tense from dataframe.
+TEI_DATE_TAG = '{http://www.tei-c.org/ns/1.0}date'
+TEI_UTTERANCE_TAG = '{http://www.tei-c.org/ns/1.0}u'
+
+AUTOMATON = None
+MIN_FORM_LENGTH = 0
+
+
+def get_future_forms(verb_forms_file):
+    """Get the list of verb forms in the future tense from the CSV file.
 
     Parameters
     ----------
-    df: pandas.DataFrame, required
-        The dataframe containing verb forms.
+    verb_forms_file: str, required
+        The path of the CSV file containing verb forms.
 
     Returns
     -------
     future_forms: list of str
         The verb forms in the future tense.
     """
-    pattern = r"^\s*(eu|tu|el\/ea|noi|voi|ei\/ele)\s"
-    future_forms = df.Viitor.map(lambda x: re.sub(
-        pattern, '', x, 0, flags=re.IGNORECASE | re.MULTILINE))
-    return [x.strip() for x in future_forms]
+    table = pyarrow.csv.read_csv(verb_forms_file)
+    return [
+        PRONOUN_PATTERN.sub('', form).strip()
+        for form in table.column('Viitor').to_pylist() if form is not None
+    ]
 
 
 def get_infinitive_forms(df):
@@ -52,54 +65,120 @@ def get_infinitive_forms(df):
     return infinitive_forms
 
 
-def get_xml_root(file_path):
-    """Parse XML from provided file and return the root node.
+def build_automaton(forms):
+    """Build an Aho-Corasick automaton matching the given verb forms.
 
     Parameters
     ----------
-    file_path: str, required
-        The path of the XML file to parse.
+    forms: iterable of str, required
+        The verb forms to match.
 
     Returns
     -------
-    xml_root: lxml.Element
-        The root element of the XML tree.
+    automaton: ahocorasick.Automaton
+        The automaton matching all verb forms in a single pass.
+
+    Notes
+    -----
+    The forms are folded to lowercase; callers are expected to
+    lowercase the scanned text once before matching.
     """
-    parser = etree.XMLParser(remove_blank_text=True)
-    xml_tree = etree.parse(file_path, parser)
-    for elem in xml_tree.iter():
-        elem.tail = None
-    return xml_tree.getroot()
+    automaton = ahocorasick.Automaton()
+    for index, form in enumerate(forms):
+        form = form.lower()
+        automaton.add_word(form, (index, form))
+    automaton.make_automaton()
+    return automaton
 
 
-def get_session_date(xml_root):
-    """Retrieve session date from the root node of the XML tree.
+def load_automaton(verb_forms_file):
+    """Load the verb-form automaton, cached on disk next to the CSV.
+
+    The automaton is pickled together with the modification time of
+    the CSV file and rebuilt whenever the CSV changes, so repeated
+    runs skip the CSV parse and the automaton construction.
 
     Parameters
     ----------
-    xml_root: etree.Element, required
-        The root node of the XML tree representing the session.
+    verb_forms_file: str, required
+        The path of the CSV file containing verb forms.
 
     Returns
     -------
-    date: datetime.date
-        The date of the sesssion.
+    automaton: ahocorasick.Automaton
+        The automaton matching the future forms.
     """
-    date_elem, *_ = [
-        elem for elem in xml_root.iterdescendants()
-        if 'date' in elem.tag and 'setting' in elem.getparent().tag
-    ]
-    date = datetime.strptime(date_elem.get('when'), '%Y-%m-%d').date()
-    return date
+    cache_file = verb_forms_file + '.automaton.pkl'
+    mtime = os.stat(verb_forms_file).st_mtime
+    try:
+        with open(cache_file, 'rb') as cache:
+            cached_mtime, automaton = pickle.load(cache)
+        if cached_mtime == mtime:
+            return automaton
+    except Exception:
+        logging.info("Rebuilding the verb-form automaton.")
+    automaton = build_automaton(get_future_forms(verb_forms_file))
+    temp_file = cache_file + '.tmp'
+    with open(temp_file, 'wb') as cache:
+        pickle.dump((mtime, automaton), cache)
+    os.replace(temp_file, cache_file)
+    return automaton
+
+
+def init_worker(automaton):
+    """Store the automaton in a global of the worker process.
 
+    Parameters
+    ----------
+    automaton: ahocorasick.Automaton, required
+        The automaton matching the verb forms.
+    """
+    global AUTOMATON, MIN_FORM_LENGTH
+    AUTOMATON = automaton
+    MIN_FORM_LENGTH = min(map(len, automaton.keys()))
+
+
+def iterate_utterances(file_name):
+    """Iterate over the utterances of a corpus file in a single pass.
 
-def get_form_statistics(forms, file_name):
+    Parameters
+    ----------
+    file_name: str, required
+        The path of the corpus file to parse.
+
+    Returns
+    -------
+    utterance_generator: generator of (datetime.date, str, str)
+        The generator of (session date, speaker, text) tuples.
+    """
+    date = None
+    context = etree.iterparse(file_name,
+                              events=('end', ),
+                              tag=(TEI_DATE_TAG, TEI_UTTERANCE_TAG))
+    for _, elem in context:
+        if elem.tag == TEI_DATE_TAG:
+            if 'setting' in elem.getparent().tag:
+                date = date_type.fromisoformat(elem.get('when'))
+        else:
+            speaker = elem.get('who')
+            text = etree.tostring(elem,
+                                  method='text',
+                                  encoding='unicode',
+                                  with_tail=False)
+            yield date, speaker, text
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+
+def get_form_statistics(file_name):
     """Get statistics on form usage.
 
+    The automaton matching the verb forms is read from the global
+    set by ``init_worker``.
+
     Parameters
     ----------
-    forms: iterable of str, required
-        The forms for which to count statistics.
     file_name: str, required
         The corpus file from which to count statistics.
 
@@ -109,28 +188,24 @@ def get_form_statistics(forms, file_name):
         Verb form usage statistics with the structure
         ((speaker, date, verb form), count).
     """
-    xml = get_xml_root(file_name)
-    date = get_session_date(xml)
     stats = {}
-    for u in xml.iterdescendants('{http://www.tei-c.org/ns/1.0}u'):
-        speaker = u.get('who')
-        text = ''.join(u.itertext())
-        for f in forms:
-            acc = text.count(f)
-            key = (speaker, date, f)
-            if key in stats:
-                acc = acc + stats[key]
-            stats[key] = acc
-    return {k: v for k, v in stats.items() if v > 0}
-
-
-def get_usage_statistics(forms, file_name):
+    for date, speaker, text in iterate_utterances(file_name):
+        if len(text) < MIN_FORM_LENGTH:
+            continue
+        for _, (_, form) in AUTOMATON.iter(text.lower()):
+            key = (speaker, date, form)
+            stats[key] = stats.get(key, 0) + 1
+    return stats
+
+
+def get_usage_statistics(file_name):
     """Get usage statistics.
 
+    The automaton matching the verb forms is read from the global
+    set by ``init_worker``.
+
     Parameters
     ----------
-    forms: iterable of str, required
-        The forms for which to count statistics.
     file_name: str, required
         The corpus file from which to count statistics.
 
@@ -139,23 +214,21 @@ def get_usage_statistics(forms, file_name):
     (date, stats): tuple of date, dict
         The date and the statistics for that date.
     """
-    xml = get_xml_root(file_name)
-    date = get_session_date(xml)
+    date = None
     stats = {}
-    for u in xml.iterdescendants('{http://www.tei-c.org/ns/1.0}u'):
-        speaker = u.get('who')
-        text = ''.join(u.itertext())
+    for date, speaker, text in iterate_utterances(file_name):
         future_usage, num_utterances, num_words = stats[
             speaker] if speaker in stats else (0, 0, 0)
-        future_usage += sum([text.count(form) for form in forms])
+        if len(text) >= MIN_FORM_LENGTH:
+            future_usage += sum(1 for _ in AUTOMATON.iter(text.lower()))
         num_utterances = num_utterances + 1
         num_words = num_words + len(list(split_words(text)))
         stats[speaker] = (future_usage, num_utterances, num_words)
     return date, stats
 
 
-def iterate_corpus_files(root_file):
-    """Iterate over corpus files included in root file.
+def list_corpus_files(root_file):
+    """List the corpus files included in root file.
 
     Parameters
     ----------
@@ -164,81 +237,75 @@ def iterate_corpus_files(root_file):
 
     Returns
     -------
-    file_generator: generator of str
-        The generator of corpus files.
+    file_names: list of str
+        The sorted list of corpus file paths.
     """
     root_file_path = Path(root_file)
+    return sorted(
+        str(file_path) for file_path in root_file_path.parent.glob('*.xml')
+        if file_path != root_file_path and '.ana' not in file_path.suffixes)
 
-    for file_path in root_file_path.parent.glob('*.xml'):
-        if file_path == root_file_path:
-            continue
-        if '.ana' in file_path.suffixes:
-            continue
 
-        file_name = str(file_path)
-        logging.info("Extracting statistics from %s.", file_name)
-        yield file_name
+def save_statistics(df_stats, output_file):
+    """Save the statistics dataframe to the output file.
+
+    The format is chosen from the file extension: Parquet for
+    '.parquet' files, CSV written through PyArrow otherwise. The
+    meaningless range index is not written in either case.
+
+    Parameters
+    ----------
+    df_stats: pandas.DataFrame, required
+        The dataframe containing statistics.
+    output_file: str, required
+        The path of the output file.
+    """
+    if output_file.endswith('.parquet'):
+        df_stats.to_parquet(output_file, index=False)
+    else:
+        table = pyarrow.Table.from_pandas(df_stats, preserve_index=False)
+        pyarrow.csv.write_csv(table, output_file)
 
 
 def count_usage_per_session(args):
     """Where the magic happens."""
     logging.info("Loading verb forms.")
-    df = pandas.read_csv(args.verb_forms_file)
-
-    logging.info("Extracting future forms.")
-    future_forms = get_future_forms(df)
+    automaton = load_automaton(args.verb_forms_file)
 
-    logging.info("Computing statistics.")
+    files = list_corpus_files(args.corpus_root_file)
+    logging.info("Computing statistics for %s corpus files.", len(files))
 
-    data = Parallel(n_jobs=args.num_jobs)(
-        delayed(get_usage_statistics)(future_forms, f)
-        for f in iterate_corpus_files(args.corpus_root_file))
+    with ProcessPoolExecutor(max_workers=args.num_jobs,
+                             initializer=init_worker,
+                             initargs=(automaton, )) as executor:
+        data = list(executor.map(get_usage_statistics, files, chunksize=4))
 
     logging.info("Aggregating statistics.")
-    global_stats = {}
-    speakers = set()
-    dates = set()
-    for date, stats in data:
-        dates.add(date)
-        global_stats[date] = stats
-        for speaker in stats.keys():
-            speakers.add(speaker)
-
-    result = {
-        'Speaker': [],
-        'Date': [],
-        'UsageCount': [],
-        'NumUtterances': [],
-        'NumWords': []
-    }
-    for speaker, date in product(speakers, dates):
-        result['Speaker'].append(speaker)
-        result['Date'].append(date)
-        session_stats = global_stats[date]
-        usage_count, num_utterances, num_words = session_stats[
-            speaker] if speaker in session_stats else (None, None, None)
-        result['UsageCount'].append(usage_count)
-        result['NumUtterances'].append(num_utterances)
-        result['NumWords'].append(num_words)
-    df_stats = pandas.DataFrame(result)
+    rows = [(speaker, date) + speaker_stats
+            for date, stats in data
+            for speaker, speaker_stats in stats.items()]
+    df_stats = pandas.DataFrame(rows,
+                                columns=[
+                                    'Speaker', 'Date', 'UsageCount',
+                                    'NumUtterances', 'NumWords'
+                                ])
     output_file = args.statistics_file
     logging.info("Saving statistics to %s.", output_file)
-    df_stats.to_csv(output_file)
+    save_statistics(df_stats, output_file)
 
 
 def count_usage_per_verb_form(args):
     """Count future tense usage per verb form."""
     logging.info("Loading verb forms.")
-    df = pandas.read_csv(args.verb_forms_file)
-
-    logging.info("Extracting future forms.")
-    future_forms = get_future_forms(df)
+    automaton = load_automaton(args.verb_forms_file)
 
-    logging.info("Computing statistics.")
+    files = list_corpus_files(args.corpus_root_file)
+    logging.info("Computing statistics for %s corpus files.", len(files))
 
-    data = Parallel(n_jobs=args.num_jobs)(
-        delayed(get_form_statistics)(future_forms, f)
-        for f in iterate_corpus_files(args.corpus_root_file))
+    with ProcessPoolExecutor(max_workers=args.num_jobs,
+                             initializer=init_worker,
+                             initargs=(automaton, )) as executor:
+        data = list(executor.map(get_form_statistics, files, chunksize=4))
 
     logging.info("Aggregating statistics.")
     result = {'Speaker': [], 'Date': [], 'Form': [], 'Count': []}
@@ -253,7 +320,7 @@ def count_usage_per_verb_form(args):
     df_stats = pandas.DataFrame(result)
     output_file = args.statistics_file
     logging.info("Saving statistics to %s.", output_file)
-    df_stats.to_csv(output_file)
+    save_statistics(df_stats, output_file)
 
 
 def parse_arguments():
@@ -269,9 +336,10 @@ def parse_arguments():
         default='../data/verb-forms.csv')
     root_parser.add_argument(
         '--num-jobs',
-        help="The maximum number of concurrently running jobs.",
+        help="The maximum number of worker processes to use; "
+        "defaults to the number of CPUs.",
         type=int,
-        default=-2)
+        default=None)
     root_parser.add_argument(
         '-l',
         '--log-level',
@@ -11,24 +11,37 @@ import matplotlib.pyplot as plt
 # top 10 cei mai promițători
 # Statistici pe partide
 
+LEGISLATURE_TERM_PATTERN = re.compile(r"(\d{4})-(\d{4})")
 
-def get_legislature_term(file_name):
-    """Get legislature term from file name.
+NAME_TRANSLATION = str.maketrans({
+    '#': '',
+    'Ș': 's',
+    'ș': 's',
+    'Ț': 't',
+    'ț': 't',
+    '-': ' '
+})
+
+
+def load_statistics(statistics_file):
+    """Load the statistics dataframe from the given file.
+
+    The format is chosen from the file extension: Parquet for
+    '.parquet' files, CSV otherwise.
 
     Parameters
     ----------
-    file_name: str, required
-        The file name containing legislature info.
+    statistics_file: str, required
+        The path of the file containing usage statistics.
 
     Returns
     -------
-    (start, end): tuple of int, int
-        Start and end year of the legislature.
+    stats: pandas.DataFrame
+        The dataframe containing statistics.
     """
-    regex = r"(\d{4})-(\d{4})"
-    match = re.search(regex, file_name)
-    start, end = match.groups()
-    return (int(start), int(end))
+    if statistics_file.endswith('.parquet'):
+        return pd.read_parquet(statistics_file)
+    return pd.read_csv(statistics_file)
 
 
 def get_name_parts(name_or_id):
@@ -44,14 +57,8 @@ def get_name_parts(name_or_id):
     name_parts: set
         The set of canonical name parts.
     """
-    name = name_or_id.replace('#', '')
-    name = name.replace('Ș', 's')
-    name = name.replace('ș', 's')
-    name = name.replace('Ț', 't')
-    name = name.replace('ț', 't')
-    name = name.replace('-', ' ').lower()
-    name_parts = name.split()
-    return set(name_parts)
+    name = name_or_id.translate(NAME_TRANSLATION).lower()
+    return set(name.split())
 
 
 def load_legislature_data(data_directory):
@@ -62,50 +69,52 @@ def load_legislature_data(data_directory):
     data_directory: str, required
         The path of parent directory containing legislature data.
     """
-    names = {'Name': [], 'Start': [], 'End': [], 'Party': []}
-    name_parts = {}
     data_dir = Path(data_directory)
-    for file_path in data_dir.glob('*.csv'):
-        df = pd.read_csv(str(file_path))
-        start, end = get_legislature_term(file_path.stem)
-
-        for _, tup in df.iterrows():
-            name = tup[0]
-            party = str(tup[1]).strip()
-            names['Name'].append(name)
-            names['Start'].append(start)
-            names['End'].append(end)
-            names['Party'].append(party)
-            if name not in name_parts:
-                name_parts[name] = get_name_parts(name)
-    return (name_parts, pd.DataFrame(names))
-
-
-def find_name(speaker_id, names):
+    file_paths = sorted(data_dir.glob('*.csv'))
+    if not file_paths:
+        return ({}, pd.DataFrame(columns=['Name', 'Start', 'End', 'Party']))
+    stems = pd.Series([file_path.stem for file_path in file_paths])
+    terms = stems.str.extract(LEGISLATURE_TERM_PATTERN).astype(int)
+
+    name_index = {}
+    frames = []
+    for index, file_path in enumerate(file_paths):
+        df = pd.read_csv(str(file_path)).iloc[:, :2]
+        df.columns = ['Name', 'Party']
+        df['Party'] = df.Party.astype(str).str.strip()
+        df['Start'] = terms.iloc[index, 0]
+        df['End'] = terms.iloc[index, 1]
+        frames.append(df)
+
+        parts = df.Name.str.translate(NAME_TRANSLATION).str.lower().str.split()
+        name_index.update(
+            (frozenset(name_parts), name)
+            for name, name_parts in zip(df.Name, parts))
+    names = pd.concat(frames, ignore_index=True)
+    return (name_index, names[['Name', 'Start', 'End', 'Party']])
+
+
+def find_name(speaker_id, name_index):
     """Lookup speaker name based on the id.
 
     Parameters
     ----------
     speaker_id: str, required
         The id of the speaker.
-    names: dict of str, set
-        The dictionary of names and name parts.
+    name_index: dict of frozenset, str
+        The mapping between name parts and speaker names.
 
     Returns
     -------
     name: str
         Speaker name if found; otherwise None.
     """
-    name_parts = get_name_parts(speaker_id)
-    for name, parts in names.items():
-        if name_parts == parts:
-            return name
-    return None
+    return name_index.get(frozenset(get_name_parts(speaker_id)))
 
 
 def plot_most_frequent_forms(args):
     """Create a plot of most frequent verb forms."""
-    stats = pd.read_csv(args.statistics_file)
+    stats = load_statistics(args.statistics_file)
     grouped = stats.groupby(stats.Form)
     aggregated = grouped['Count'].sum().sort_values(ascending=False)
     aggregated = aggregated.head(args.N).to_frame()
@@ -117,7 +126,7 @@ def plot_most_frequent_forms(args):
     print(aggregated)
 
 
-def aggregate_data_for_top_speakers(stats, n, name_parts):
+def aggregate_data_for_top_speakers(stats, n, name_index):
     """Aggregate the statistics to get top n speakers.
 
     Parameters
@@ -126,35 +135,30 @@ def aggregate_data_for_top_speakers(stats, n, name_parts):
         The dataframe containing statistics.
     n: int, required
         Number of speakers to return.
-    name_parts: dict, required
-        The mapping between id and name parts.
+    name_index: dict of frozenset, str, required
+        The mapping between name parts and speaker names.
 
     Returns
     -------
     aggregated_data: pandas.DataFrame
         The aggregated data for top n speakers.
     """
-    aggregated_stats = {'Speaker': [], 'UsageCount': [], 'FutureUsage': []}
-    for speaker, data in stats.groupby(stats.Speaker):
-        speaker_name = find_name(speaker, name_parts)
-        if not speaker_name:
-            speaker_name = speaker.replace('#', '').replace('-', ' ')
-        aggregated_stats['Speaker'].append(speaker_name)
-        aggregated_stats['UsageCount'].append(data.UsageCount.sum())
-        percentage = (data.UsageCount.sum() / data.NumWords.sum()) * 100
-        aggregated_stats['FutureUsage'].append(percentage)
-    aggregated = pd.DataFrame(aggregated_stats).sort_values(by='UsageCount',
-                                                            ascending=False)
-    aggregated.to_csv('aggregated-data.csv')
-    aggregated = aggregated.head(n)
-    return aggregated
+    aggregated = stats.groupby('Speaker', sort=False).agg(
+        UsageCount=('UsageCount', 'sum'), NumWords=('NumWords', 'sum'))
+    aggregated['FutureUsage'] = \
+        aggregated.UsageCount / aggregated.NumWords * 100
+    aggregated.index = aggregated.index.map(
+        lambda speaker: find_name(speaker, name_index) or speaker.replace(
+            '#', '').replace('-', ' '))
+    aggregated = aggregated.drop(columns='NumWords')
+    return aggregated.nlargest(n, 'UsageCount').reset_index()
 
 
 def plot_top_speakers(args):
     """Create plot of top speakers."""
-    name_parts, _ = load_legislature_data(args.legislatures)
-    stats = pd.read_csv(args.statistics_file)
-    data = aggregate_data_for_top_speakers(stats, args.N, name_parts)
+    name_index, _ = load_legislature_data(args.legislatures)
+    stats = load_statistics(args.statistics_file)
+    data = aggregate_data_for_top_speakers(stats, args.N, name_index)
     fig, ax = plt.subplots()
     future_usage = [x * 1000 for x in data.FutureUsage]
     ax.bar(list(data.Speaker),
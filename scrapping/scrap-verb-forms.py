@@ -1,16 +1,40 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """Script for crawling verb forms from https://conjugare.ro."""
+import aiohttp
+from aiolimiter import AsyncLimiter
 import argparse
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import csv
 import logging
-import pandas
-import requests
+from itertools import zip_longest
 from lxml import html
-import time
+import os
 import random
+import sys
 
 URL = 'https://conjugare.ro'
 
+USER_AGENT = 'future-tense-usage-scraper'
+
+MAX_CONCURRENT_REQUESTS = 16
+
+MAX_REQUESTS_PER_SECOND = 5
+
+MAX_FETCH_ATTEMPTS = 5
+
+MAX_RETRY_DELAY = 60
+
+MAX_PAGE_SIZE = 512 * 1024
+
+RATE_LIMITER = AsyncLimiter(MAX_REQUESTS_PER_SECOND, time_period=1)
+
+PARSER = html.HTMLParser(encoding='utf-8',
+                         remove_blank_text=True,
+                         remove_comments=True,
+                         collect_ids=False)
+
 
 class Resources:
     """Wrapper class for magic strings."""
@@ -19,12 +43,15 @@ class Resources:
     FormNameTag = 'b'
     VerbFormTag = 'div'
     VerbFormCssClass = 'cont_conj'
-    ContentBoxXPath = "//div[@class='box_conj']"
+    ContentBoxCssClass = 'box_conj'
 
 
 def load_verbs(input_file, delimiter=';'):
     """Read the verbs from the specified file and removes duplicates.
 
+    The verbs are stripped of surrounding whitespace and lowercased,
+    so entries differing only in case are fetched once.
+
     Parameters
     ----------
     input_file : str, required
@@ -38,77 +65,78 @@ def load_verbs(input_file, delimiter=';'):
     verb_list : list of str
         The list of verbs.
     """
-    df = pandas.read_csv(input_file, sep=delimiter)
-    return list(df[df.columns[0]].unique())
+    with open(input_file, newline='', encoding='utf-8') as verbs_file:
+        reader = csv.reader(verbs_file, delimiter=delimiter)
+        next(reader, None)
+        return list(
+            dict.fromkeys(row[0].strip().lower() for row in reader if row))
 
 
-def is_form_name(element):
-    """Check if the given element is a form name element.
+def load_completed_verbs(done_file):
+    """Load the set of verbs already scraped from the checkpoint file.
 
     Parameters
     ----------
-    element: etree.Element, required
-        The tag to check.
+    done_file: str, required
+        The path of the checkpoint file.
 
     Returns
     -------
-    is_form_name: bool
-        Returns True if this is a form name tag; otherwise False.
+    done: set of str
+        The verbs recorded as completed; empty if there is no
+        checkpoint.
     """
-    return element.tag.lower() == Resources.FormNameTag
+    try:
+        with open(done_file, encoding='utf-8') as checkpoint:
+            return set(checkpoint.read().splitlines())
+    except OSError:
+        return set()
 
 
-def is_verb_form(element):
-    """Check if the given element is a verb form element.
+def parse_html(body):
+    """Parse an HTML page from its raw contents.
 
     Parameters
     ----------
-    element: etree.Element, required
-        The tag to check.
+    body: bytes, required
+        The raw contents of the page.
 
     Returns
     -------
-    is_verb_form: bool
-        Returns True if this is a verb form tag; otherwise False.
+    page_content: etree.Element
+        The root element of the parsed page.
     """
-    name = element.tag.lower()
-    if name != Resources.VerbFormTag:
-        return False
+    return html.fromstring(body, parser=PARSER)
 
-    css_class = element.get('class')
-    if css_class is not None:
-        css_class = css_class.lower()
-    return Resources.VerbFormCssClass in css_class
 
+def parse_page(body):
+    """Parse the verb forms out of the raw contents of a page.
 
-def parse_verb_form(form_content):
-    """Parse the verb form from HTML element.
+    Combines the HTML parse and the content extraction so that only
+    the raw bytes and the resulting dict cross the boundary of the
+    parsing process pool.
 
     Parameters
     ----------
-    form_content: etree.Element, required
-        The HTML element containing inflected verb forms.
+    body: bytes, required
+        The raw contents of the page.
 
     Returns
     -------
-    (form_name, verb_forms): tuple of (str, list of str)
-        The form name and inflected forms of the verb.
+    verb_forms : dict
+        The verb forms extracted from the page.
+        None if content cannot be parsed.
     """
-    verb_forms = []
-    form_name = ''
-    for tag in form_content:
-        if is_form_name(tag):
-            form_name = tag.text
-        if is_verb_form(tag):
-            text = ''.join(tag.itertext()).strip()
-            if text != '-':
-                verb_forms.append(text)
-    return (form_name, verb_forms)
+    return parse_page_contents(parse_html(body))
 
 
 def parse_page_contents(page):
     """Parse the contents of the page.
 
+    The page is traversed in a single pass: a form-name element inside
+    a content box starts a new form, and every verb-form element in a
+    content box appends to the form started last.
+
     Parameters
     ----------
     page : etree.Element, required
@@ -124,45 +152,168 @@ def parse_page_contents(page):
         return None
 
     verb_forms = {}
-    content_boxes = page.xpath(Resources.ContentBoxXPath)
-    for content_box in content_boxes:
-        form_name, verbs = parse_verb_form(content_box)
-        verb_forms[form_name] = verbs
+    form_name = None
+    for element in page.iter(Resources.FormNameTag, Resources.VerbFormTag):
+        if element.tag == Resources.FormNameTag:
+            parent_class = element.getparent().get('class')
+            if parent_class is not None \
+                    and Resources.ContentBoxCssClass in parent_class:
+                form_name = element.text
+                if form_name is not None:
+                    form_name = sys.intern(form_name)
+                verb_forms[form_name] = []
+        elif form_name is not None \
+                and Resources.VerbFormCssClass in (element.get('class') or ''):
+            parent_class = element.getparent().get('class')
+            if parent_class is None \
+                    or Resources.ContentBoxCssClass not in parent_class:
+                continue
+            if len(element) == 0:
+                text = (element.text or '').strip()
+            else:
+                text = ''.join(element.itertext()).strip()
+            if text and text != '-':
+                verb_forms[form_name].append(text)
 
     return verb_forms
 
 
-def main(args):
+async def fetch(session, semaphore, verb):
+    """Fetch the conjugation page of the given verb.
+
+    Parameters
+    ----------
+    session: aiohttp.ClientSession, required
+        The session through which to issue the request.
+    semaphore: asyncio.Semaphore, required
+        The semaphore bounding the number of in-flight requests.
+    verb: str, required
+        The verb for which to fetch the conjugation page.
+
+    Returns
+    -------
+    (verb, body): tuple of (str, bytes)
+        The verb and the raw contents of its conjugation page;
+        the body is None when the retries are exhausted.
+    """
+    url = '{}/romana.php?conjugare={}'.format(URL, verb)
+    async with semaphore:
+        logging.info("Scrapping forms for %s.", verb)
+        for attempt in range(MAX_FETCH_ATTEMPTS):
+            retry_after = None
+            try:
+                async with RATE_LIMITER:
+                    async with session.get(url) as response:
+                        if response.status == 200:
+                            return verb, await response.content.read(
+                                MAX_PAGE_SIZE)
+                        status = response.status
+                        retry_after = response.headers.get('Retry-After')
+                logging.warning("Got status %s for %s.", status, verb)
+            except (aiohttp.ClientError, asyncio.TimeoutError,
+                    OSError) as error:
+                logging.warning("Request for %s failed: %s", verb, error)
+            if attempt == MAX_FETCH_ATTEMPTS - 1:
+                break
+            try:
+                delay = min(float(retry_after), MAX_RETRY_DELAY)
+            except (TypeError, ValueError):
+                delay = 2 ** attempt + random.random()
+            logging.info("Retrying %s in %s seconds.", verb, delay)
+            await asyncio.sleep(delay)
+    logging.error("Giving up on %s after %s attempts.", verb,
+                  MAX_FETCH_ATTEMPTS)
+    return verb, None
+
+
+async def scrape(session, semaphore, parse_pool, verb):
+    """Fetch and parse the conjugation page of the given verb.
+
+    Parameters
+    ----------
+    session: aiohttp.ClientSession, required
+        The session through which to issue the request.
+    semaphore: asyncio.Semaphore, required
+        The semaphore bounding the number of in-flight requests.
+    parse_pool: concurrent.futures.ProcessPoolExecutor, required
+        The pool of processes in which pages are parsed.
+    verb: str, required
+        The verb for which to scrape conjugation forms.
+
+    Returns
+    -------
+    (verb, data): tuple of (str, dict)
+        The verb and its parsed forms; the forms are None when the
+        fetch failed and empty when the page holds no data.
+    """
+    verb, body = await fetch(session, semaphore, verb)
+    if body is None:
+        return verb, None
+    loop = asyncio.get_running_loop()
+    data = await loop.run_in_executor(parse_pool, parse_page, body)
+    return verb, data if data is not None else {}
+
+
+async def main(args):
     """Where the magic happens."""
     verbs = load_verbs(args.verbs_file)
     logging.info("Loaded %s distinct entries from verbs file.", len(verbs))
-    result = None
+    done_file = args.output_file + '.done'
+    done = load_completed_verbs(done_file)
+    if done:
+        verbs = [verb for verb in verbs if verb not in done]
     logging.info("Remaining verbs to process: %s", len(verbs))
     logging.info("Start scraping verb forms.")
-    for verb in verbs:
-        logging.info("Scrapping forms for %s.", verb)
-        url = '{}/romana.php?conjugare={}'.format(URL, verb)
-        page = requests.get(url)
-        page_content = html.fromstring(page.content)
-        data = parse_page_contents(page_content)
-
-        if data is None or len(data.values()) == 0:
-            logging.info("No data found for %s.", verb)
-            continue
-
-        max_len = max([len(col) for col in data.values()])
-        for key, value in data.items():
-            data[key] = value + ([None] * (max_len - len(value)))
-        df = pandas.DataFrame.from_dict(data)
-        result = df if result is None else pandas.concat([result, df])
-        logging.info("Saving results to %s.", args.output_file)
-        result.to_csv(args.output_file)
-
-        sleep_interval = random.randint(0, 1)
-        logging.info("Sleeping for %s seconds.", sleep_interval)
-        time.sleep(sleep_interval)
-
-    print(result)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    connector = aiohttp.TCPConnector(limit_per_host=MAX_CONCURRENT_REQUESTS,
+                                     ttl_dns_cache=300)
+    logging.info("Saving results to %s.", args.output_file)
+    columns = None
+    output_mode = 'w'
+    if done and os.path.exists(args.output_file):
+        with open(args.output_file, newline='') as existing:
+            columns = next(csv.reader(existing), None)
+        output_mode = 'a'
+    num_saved = 0
+    with ProcessPoolExecutor() as parse_pool, \
+            open(args.output_file, output_mode, newline='') as output, \
+            open(done_file, 'a', encoding='utf-8') as checkpoint:
+        writer = csv.writer(output)
+        async with aiohttp.ClientSession(
+                connector=connector,
+                headers={'User-Agent': USER_AGENT}) as session:
+            tasks = [
+                scrape(session, semaphore, parse_pool, verb) for verb in verbs
+            ]
+            for task in asyncio.as_completed(tasks):
+                verb, data = await task
+                if data is None:
+                    continue
+
+                if len(data.values()) == 0:
+                    logging.info("No data found for %s.", verb)
+                    checkpoint.write(verb + '\n')
+                    checkpoint.flush()
+                    continue
+
+                if columns is None:
+                    columns = list(data.keys())
+                    writer.writerow(columns)
+                missing = [
+                    column for column in data if column not in columns
+                ]
+                if missing:
+                    logging.warning("Dropping forms %s for %s; not in header.",
+                                    missing, verb)
+                writer.writerows(
+                    zip_longest(*(data.get(column, ()) for column in columns),
+                                fillvalue=None))
+                output.flush()
+                checkpoint.write(verb + '\n')
+                checkpoint.flush()
+                num_saved += 1
+
+    logging.info("Saved forms for %s verbs.", num_saved)
     logging.info("That's all folks!")
 
 
@@ -190,4 +341,4 @@ if __name__ == '__main__':
     args = parse_arguments()
     logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s',
                         level=getattr(logging, args.log_level.upper()))
-    main(args)
+    asyncio.run(main(args))